@@ -6,7 +6,10 @@ import numpy as np
 from simulation_functions import (Distribution, inverse_transform_method_exponential,
                                   output_analysis_data, plot_orderbook_metrics,
                                   multiple_simulations, output_simulation_results,
-                                  simulation_results_across_parameters)
+                                  simulation_results_across_parameters, HawkesArrivals,
+                                  arrival_counts, expected_arrival_counts,
+                                  variance_reduced_results_across_parameters,
+                                  paired_differences_across_parameters)
 from orderbook import OrderBook
 from investors import Buyer, Seller
 
@@ -83,29 +86,73 @@ for i in range(len(orderbook.trade_history)):
     all_trades_time.append(orderbook.trade_history[i][1])
     all_trades_price.append(orderbook.trade_history[i][0])
 
+
+# clustered order flow: Hawkes arrivals with the same long run rate (1 per minute) as the neutral market
+def hawkes_arrival_process(rng):
+    return HawkesArrivals(0.4, 0.6, 1.0, rng=rng)
+
+
 # ----- Simulation Results and Visuals -----
 
+# every scenario shares its seeded arrival and noise streams (common random numbers) and runs as 15 antithetic
+# pairs, so the same replications feed the plain CIs, the variance reduced CIs and the paired differences
 simulation_results_neutral = multiple_simulations(30, 100, 0.02, 1,
-                                                  1, 6, 0)
+                                                  1, 6, 0,
+                                                  common_random_numbers=True, antithetic=True)
 simulation_results_bull = multiple_simulations(30, 100, 0.02, 2,
-                                               1, 6, 0)
+                                               1, 6, 0,
+                                               common_random_numbers=True, antithetic=True)
 simulation_results_bear = multiple_simulations(30, 100, 0.02, 1,
-                                               2, 6, 0)
+                                               2, 6, 0,
+                                               common_random_numbers=True, antithetic=True)
+simulation_results_clustered = multiple_simulations(30, 100, 0.02, 1,
+                                                    1, 6, 0,
+                                                    buyer_arrival_process=hawkes_arrival_process,
+                                                    seller_arrival_process=hawkes_arrival_process,
+                                                    common_random_numbers=True, antithetic=True)
 
 simulation_results_runs_neutral = output_simulation_results(simulation_results_neutral)[0]
 simulation_results_runs_bull = output_simulation_results(simulation_results_bull)[0]
 simulation_results_runs_bear = output_simulation_results(simulation_results_bear)[0]
+simulation_results_runs_clustered = output_simulation_results(simulation_results_clustered)[0]
 
 simulation_results_runs_dict = {
     "neutral": simulation_results_runs_neutral,
     "bull": simulation_results_runs_bull,
-    "bear": simulation_results_runs_bear
+    "bear": simulation_results_runs_bear,
+    "clustered": simulation_results_runs_clustered
 }
 
 overall_results = simulation_results_across_parameters(simulation_results_runs_dict)
 
 print(f'----- Neutral -----\n{overall_results["neutral"]}\n\n----- Bull -----\n{overall_results["bull"]}'
-      f'\n\n----- Bear -----\n{overall_results["bear"]}')
+      f'\n\n----- Bear -----\n{overall_results["bear"]}\n\n----- Clustered -----\n{overall_results["clustered"]}')
+
+# ----- Variance Reduction: Antithetic Pairs, Arrival Count Controls and Paired Differences -----
+arrival_counts_dict = {
+    "neutral": arrival_counts(simulation_results_neutral),
+    "bull": arrival_counts(simulation_results_bull),
+    "bear": arrival_counts(simulation_results_bear),
+    "clustered": arrival_counts(simulation_results_clustered)
+}
+expected_arrival_counts_dict = {
+    "neutral": expected_arrival_counts(1, 1, 6, 0),
+    "bull": expected_arrival_counts(2, 1, 6, 0),
+    "bear": expected_arrival_counts(1, 2, 6, 0),
+    "clustered": expected_arrival_counts(1, 1, 6, 0,
+                                         buyer_arrival_process=hawkes_arrival_process,
+                                         seller_arrival_process=hawkes_arrival_process)
+}
+
+vr_results = variance_reduced_results_across_parameters(simulation_results_runs_dict, antithetic=True,
+                                                        controls_dict=arrival_counts_dict,
+                                                        control_means_dict=expected_arrival_counts_dict)
+vr_differences = paired_differences_across_parameters(simulation_results_runs_dict, "neutral", antithetic=True)
+
+for market in vr_results:
+    print(f'\n----- {market.capitalize()} (variance reduced) -----\n{vr_results[market]}')
+for market in vr_differences:
+    print(f'\n----- {market.capitalize()} - Neutral (paired) -----\n{vr_differences[market]}')
 
 (time, best_bids_ts, best_asks_ts, midpoint_ts, spread_ts, completed_wait_times, ongoing_wait_times,
  total_wait_times, bid_queue_size, ask_queue_size, all_bids_prices, all_bids_times, all_asks_prices,
@@ -27,6 +27,195 @@ def inverse_transform_method_exponential(u, arrival_rate):
     return - (1 / arrival_rate) * np.log(u)
 
 
+class RandomStream:
+    """
+    Attributes:
+    - seed: seed (or sequence of seeds) for this stream's own numpy Generator
+    - antithetic: if True every uniform u is replaced by 1 - u
+
+    Overview:
+    A dedicated source of random numbers for a single model input (e.g. buyer arrivals or seller price noise).
+    Giving each input its own stream keeps the draws synchronized across scenarios (common random numbers), and the
+    antithetic flag produces the negatively correlated twin of a replication. Exponentials are generated by the
+    inverse transform so they stay monotone in the underlying uniforms. Exposes uniform/exponential like np.random,
+    so it can be passed as rng to the arrival processes below.
+    """
+
+    def __init__(self, seed, antithetic=False):
+        self.generator = np.random.default_rng(seed)
+        self.antithetic = antithetic
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        u = self.generator.random(size)
+        if self.antithetic:
+            u = 1 - u
+        return low + (high - low) * u
+
+    def exponential(self, scale=1.0, size=None):
+        return inverse_transform_method_exponential(1 - self.uniform(size=size), 1 / scale)
+
+
+class NonHomogeneousPoissonArrivals(Distribution):
+    """
+    Inter-arrival times of a non-homogeneous Poisson process, generated by thinning.
+
+    Attributes:
+    - rate_fn: intensity lambda(t) in arrivals per minute, must accept a numpy array of times
+    - rate_max: upper bound of rate_fn over the simulated horizon
+    - batch_size: number of candidate events drawn per vectorized batch
+    - rng: source of random numbers (defaults to the global np.random state)
+    - horizon: optional end of the arrival window, no events are generated after it (set it whenever rate_fn is
+      zero from some time onward, otherwise the search for the next arrival never ends)
+    - max_empty_batches: optional cap on consecutive batches without an accepted candidate, exceeding it raises
+      instead of searching forever
+
+    Overview:
+    Candidate events are drawn in batches from a homogeneous process with rate rate_max and each is kept with
+    probability lambda(t) / rate_max. Accepted event times are buffered and sample() hands out the gaps between them,
+    so the process plugs into Investor.run like any other arrival Distribution. Once the horizon is passed sample()
+    returns np.inf, which simpy treats as an arrival that never happens.
+    """
+
+    def __init__(self, rate_fn, rate_max, batch_size=1024, rng=None, horizon=None, max_empty_batches=None):
+        if rate_max <= 0:
+            raise ValueError("rate_max must be positive")
+        super().__init__(self._next_interarrival)
+        self.rate_fn = rate_fn
+        self.rate_max = rate_max
+        self.batch_size = batch_size
+        self.rng = rng if rng is not None else np.random
+        self.horizon = horizon
+        self.max_empty_batches = max_empty_batches
+        self.last_time = 0.0  # time of the last event handed out
+        self.candidate_time = 0.0  # time of the last candidate event generated
+        self.event_times = np.empty(0)
+        self.position = 0
+        self.finished = False
+
+    def _refill(self):
+        empty_batches = 0
+        while not self.finished:  # keep drawing batches until at least one candidate survives the thinning
+            gaps = self.rng.exponential(1 / self.rate_max, self.batch_size)
+            times = self.candidate_time + np.cumsum(gaps)
+            self.candidate_time = times[-1]
+            rates = np.broadcast_to(np.asarray(self.rate_fn(times), dtype=float), times.shape)
+            if np.any(rates > self.rate_max):
+                raise ValueError("rate_fn exceeds rate_max, thinning would be biased")
+            accepted = times[self.rng.uniform(0, 1, self.batch_size) * self.rate_max < rates]
+            if self.horizon is not None:
+                accepted = accepted[accepted <= self.horizon]
+            if accepted.size > 0:
+                self.event_times = accepted
+                self.position = 0
+                return
+            if self.horizon is not None and self.candidate_time > self.horizon:
+                self.finished = True
+            empty_batches += 1
+            if not self.finished and self.max_empty_batches is not None and empty_batches >= self.max_empty_batches:
+                raise RuntimeError("no arrival accepted in max_empty_batches batches, set a horizon if rate_fn "
+                                   "drops to zero")
+
+    def expected_count(self, t, n_points=10001):  # integral of rate_fn over [0, t], capped at the horizon
+        t = min(t, self.horizon) if self.horizon is not None else t
+        grid = np.linspace(0, t, n_points)
+        rates = np.broadcast_to(np.asarray(self.rate_fn(grid), dtype=float), grid.shape)
+        return np.sum((rates[1:] + rates[:-1]) / 2 * np.diff(grid))
+
+    def _next_interarrival(self):
+        if self.position >= len(self.event_times):
+            self._refill()
+        if self.finished:
+            return np.inf
+        event_time = self.event_times[self.position]
+        self.position += 1
+        gap = event_time - self.last_time
+        self.last_time = event_time
+        return gap
+
+
+class HawkesArrivals(Distribution):
+    """
+    Inter-arrival times of a self-exciting (Hawkes) process with exponential kernel
+    lambda(t) = mu + sum_i alpha * exp(-beta * (t - t_i)).
+
+    Attributes:
+    - mu: baseline arrival rate per minute
+    - alpha: jump in intensity caused by each arrival
+    - beta: decay rate of the excitation (alpha / beta < 1 for a stationary process)
+    - batch_size: number of inter-arrival times generated per batch
+    - rng: source of random numbers (defaults to the global np.random state)
+
+    Overview:
+    Uses exact simulation (Dassios & Zhao, 2013): the excess intensity above mu is updated recursively after each
+    event, so an event costs O(1) no matter how many arrivals came before it. Uniforms and logarithms are computed
+    for a whole batch at once and only the recursion itself runs event by event.
+    """
+
+    def __init__(self, mu, alpha, beta, batch_size=1024, rng=None):
+        if mu <= 0:
+            raise ValueError("mu must be positive")
+        if alpha < 0:
+            raise ValueError("alpha must be non-negative")
+        if beta <= 0:
+            raise ValueError("beta must be positive")
+        if alpha / beta >= 1:
+            raise ValueError("alpha / beta must be below 1 for the Hawkes process to be stationary")
+        super().__init__(self._next_interarrival)
+        self.mu = mu
+        self.alpha = alpha
+        self.beta = beta
+        self.batch_size = batch_size
+        self.rng = rng if rng is not None else np.random
+        self.excess = 0.0  # intensity above mu just after the last event
+        self.gaps = np.empty(0)
+        self.position = 0
+
+    def stationary_rate(self):  # long run average number of arrivals per minute
+        return self.mu / (1 - self.alpha / self.beta)
+
+    def expected_count(self, t):  # expected number of arrivals in [0, t] starting from the baseline intensity
+        stationary = self.stationary_rate()
+        decay = self.beta - self.alpha
+        return stationary * t + (self.mu - stationary) * (1 - np.exp(-decay * t)) / decay
+
+    def _refill(self):
+        u = self.rng.uniform(0, 1, (2, self.batch_size))
+        baseline_gaps = -np.log(1 - u[0]) / self.mu  # next arrival from the baseline rate
+        log_u = np.log(1 - u[1])  # used for the next arrival from the decaying excitation
+        gaps = np.empty(self.batch_size)
+        excess = self.excess
+        for k in range(self.batch_size):
+            gap = baseline_gaps[k]
+            if excess > 0:
+                d = 1 + self.beta * log_u[k] / excess
+                if d > 0:
+                    gap = min(gap, -np.log(d) / self.beta)
+            excess = excess * np.exp(-self.beta * gap) + self.alpha  # decay to the new event then add its jump
+            gaps[k] = gap
+        self.excess = excess
+        self.gaps = gaps
+        self.position = 0
+
+    def _next_interarrival(self):
+        if self.position >= len(self.gaps):
+            self._refill()
+        gap = self.gaps[self.position]
+        self.position += 1
+        return gap
+
+
+def u_shaped_intraday_rate(base_rate, peak_multiplier, session_minutes):
+    """
+    Intraday seasonal intensity that is highest at the open and close and equal to base_rate mid-session.
+    Returns (rate_fn, rate_max) ready to pass to NonHomogeneousPoissonArrivals.
+    """
+    def rate_fn(t):
+        x = 2 * np.clip(t, 0, session_minutes) / session_minutes - 1  # -1 at the open, 1 at the close
+        return base_rate * (1 + (peak_multiplier - 1) * x ** 2)
+
+    return rate_fn, base_rate * max(peak_multiplier, 1)
+
+
 def output_analysis_data(orderbook):
     # --- Time series snapshots at each event ---
     time = []
@@ -162,14 +351,26 @@ def plot_orderbook_metrics(
     plt.show()
 
 
-def multiple_simulations(n_sims, p0, noise_lvl, buyer_arrival_rate, seller_arrival_rate, hours, minutes):
+def multiple_simulations(n_sims, p0, noise_lvl, buyer_arrival_rate, seller_arrival_rate, hours, minutes,
+                         buyer_arrival_process=None, seller_arrival_process=None,
+                         common_random_numbers=False, antithetic=False):
     """
     P0: Initial Price.
     noise_lvl: Pull from uniform distribution for noise using ratio difference of p0 price
     n_investor_types: Get the number of types of distributions each with their own interarrival distributions and price
     distributions
+    buyer_arrival_process / seller_arrival_process: optional factories called as factory(rng) at the start of each
+    replication, returning a fresh arrival Distribution (e.g. HawkesArrivals) that replaces the constant-rate
+    exponential for that side
+    common_random_numbers: draw buyer/seller arrivals and noise from separate seeded RandomStreams, so replication i
+    of every scenario run with this flag uses the same random numbers and scenario differences can be paired
+    antithetic: replications (0, 1), (2, 3), ... are antithetic pairs, the second run using 1 - u for every uniform;
+    implies separate streams and requires an even n_sims
     """
 
+    if antithetic and n_sims % 2 != 0:
+        raise ValueError("antithetic replications come in pairs, n_sims must be even")
+
     simulation_runs = {}
 
     p0 = p0
@@ -179,15 +380,27 @@ def multiple_simulations(n_sims, p0, noise_lvl, buyer_arrival_rate, seller_arriv
     for i in range(n_sims):
         np.random.seed(i)
 
-        buyer_arrival_dist = Distribution(
-            lambda: np.random.exponential(1 / buyer_arrival_rate))  # we can adjust the arrival rate for the buyers
-        seller_arrival_dist = Distribution(
-            lambda: np.random.exponential(1 / seller_arrival_rate))  # we can adjust the arrival rate for the sellers
+        if common_random_numbers or antithetic:
+            replication = i // 2 if antithetic else i  # antithetic twins share the seeds of their pair
+            flip = antithetic and i % 2 == 1
+            (buyer_arrival_rng, seller_arrival_rng,
+             buyer_noise_rng, seller_noise_rng) = [RandomStream((replication, stream), flip) for stream in range(4)]
+        else:
+            buyer_arrival_rng = seller_arrival_rng = buyer_noise_rng = seller_noise_rng = np.random
+
+        # we can adjust the arrival rate for the buyers
+        buyer_arrival_dist = Distribution(lambda: buyer_arrival_rng.exponential(1 / buyer_arrival_rate))
+        # we can adjust the arrival rate for the sellers
+        seller_arrival_dist = Distribution(lambda: seller_arrival_rng.exponential(1 / seller_arrival_rate))
+        if buyer_arrival_process is not None:  # time-varying or self-exciting arrivals carry state, so build per run
+            buyer_arrival_dist = buyer_arrival_process(buyer_arrival_rng)
+        if seller_arrival_process is not None:
+            seller_arrival_dist = seller_arrival_process(seller_arrival_rng)
 
         buyer_price_dist_noise = Distribution(
-            lambda: np.random.uniform(p0_min, p0_max))  # we can adjust the noise for the buyers
+            lambda: buyer_noise_rng.uniform(p0_min, p0_max))  # we can adjust the noise for the buyers
         seller_price_dist_noise = Distribution(
-            lambda: np.random.uniform(p0_min, p0_max))  # we can adjust the noise for the sellers
+            lambda: seller_noise_rng.uniform(p0_min, p0_max))  # we can adjust the noise for the sellers
 
         env = simpy.Environment(0)
         orderbook = OrderBook(p0)
@@ -318,3 +531,163 @@ def confidence_intervals(data):
     standard_error = st.sem(data)
     ci = tuple(st.t.interval(0.95, len(data) - 1, loc=mean, scale=standard_error))
     return ci
+
+
+def arrival_counts(simulation_runs):
+    """
+    Number of buy and sell orders submitted in each replication, for use as control variates.
+    Their expectation depends on the arrival processes used, see expected_arrival_counts.
+    """
+    n_buy_orders = []
+    n_sell_orders = []
+
+    for i in range(len(simulation_runs)):
+        extra = simulation_runs[str(i)]['extra']
+        n_buy_orders.append(len(extra['all_bids_prices']))
+        n_sell_orders.append(len(extra['all_asks_prices']))
+
+    return pd.DataFrame({
+        "n_buy_orders": n_buy_orders,
+        "n_sell_orders": n_sell_orders,
+    })
+
+
+def expected_arrival_counts(buyer_arrival_rate, seller_arrival_rate, hours, minutes,
+                            buyer_arrival_process=None, seller_arrival_process=None):
+    """
+    Known expectation of arrival_counts. Pass the same arrival arguments as to multiple_simulations: constant-rate
+    Poisson arrivals give rate * simulated minutes, while a custom arrival process factory is asked for its own
+    expected_count over the simulated minutes (rate * minutes would be the wrong expectation and bias the controls).
+    """
+    time_elapsed = ((hours * 60) + minutes)
+
+    def expected_count(arrival_rate, arrival_process):
+        if arrival_process is None:
+            return arrival_rate * time_elapsed
+        process = arrival_process(np.random)
+        if not hasattr(process, "expected_count"):
+            raise ValueError("arrival process has no known expected_count, it cannot be used as a control variate")
+        return process.expected_count(time_elapsed)
+
+    return pd.Series({
+        "n_buy_orders": expected_count(buyer_arrival_rate, buyer_arrival_process),
+        "n_sell_orders": expected_count(seller_arrival_rate, seller_arrival_process),
+    })
+
+
+def _variance_reduction(naive_variance, n_naive, reduced_variance):
+    # ratio of the variance of the plain replication mean to reduced_variance, the variance of the reduced estimator
+    return (naive_variance / n_naive) / reduced_variance if reduced_variance > 0 else np.inf
+
+
+def _antithetic_pair_means(data):
+    # replications (0, 1), (2, 3), ... are antithetic twins, their average is one independent observation
+    return np.asarray(data, dtype=float).reshape(-1, 2).mean(axis=1)
+
+
+def variance_reduced_confidence_intervals(data, antithetic=False, controls=None, control_means=None):
+    """
+    data: metric across replications
+    antithetic: average the antithetic pairs produced by multiple_simulations(..., antithetic=True)
+    controls: quantities with known expectation across replications (e.g. arrival_counts), one column per control
+    control_means: the known expectations of the controls
+
+    Returns (ci, naive_ci, variance_reduction) where naive_ci treats every replication as independent and
+    variance_reduction is the estimated factor by which the variance of the estimator shrank.
+    """
+    data = np.asarray(data, dtype=float)
+    naive_ci = confidence_intervals(data)
+    naive_variance = np.var(data, ddof=1)
+
+    reduced = _antithetic_pair_means(data) if antithetic else data
+    design = np.ones((len(reduced), 1))
+    if controls is not None:
+        controls = np.asarray(controls, dtype=float).reshape(len(data), -1)
+        if antithetic:
+            controls = np.column_stack([_antithetic_pair_means(c) for c in controls.T])
+        if len(reduced) <= controls.shape[1] + 1:
+            raise ValueError("too few independent observations to estimate the control coefficients")
+        design = np.column_stack([design, controls - np.asarray(control_means, dtype=float)])
+
+    # regress the data on the centred controls: the intercept is the control variate estimate and its standard
+    # error accounts for the control coefficients being estimated from the same replications
+    coefficients = np.linalg.lstsq(design, reduced, rcond=None)[0]
+    residuals = reduced - design @ coefficients
+    dof = len(reduced) - design.shape[1]
+    reduced_variance = np.sum(residuals ** 2) / dof * np.linalg.inv(design.T @ design)[0, 0]
+    ci = tuple(st.t.interval(0.95, dof, loc=coefficients[0], scale=np.sqrt(reduced_variance)))
+
+    return ci, naive_ci, _variance_reduction(naive_variance, len(data), reduced_variance)
+
+
+def variance_reduced_results_across_parameters(sim_results_dict, antithetic=False, controls_dict=None,
+                                               control_means_dict=None):
+    """
+    sim_results_dict:
+        key: parameter label
+        value: summary DataFrame containing metrics across replications
+    controls_dict / control_means_dict: optional, same keys, controls across replications and their expectations
+
+    Returns a dict of DataFrames (one per market) with the variance reduced CI, the naive CI and the variance
+    reduction achieved for each metric.
+    """
+
+    results = {}
+
+    for market, summary_df in sim_results_dict.items():
+        controls = controls_dict[market] if controls_dict is not None else None
+        control_means = control_means_dict[market] if control_means_dict is not None else None
+
+        market_df = pd.DataFrame(index=summary_df.columns, columns=["ci", "naive_ci", "variance_reduction"])
+        for metric in summary_df.columns:
+            market_df.loc[metric] = variance_reduced_confidence_intervals(summary_df[metric], antithetic,
+                                                                          controls, control_means)
+        results[market] = market_df
+
+    return results
+
+
+def paired_differences_across_parameters(sim_results_dict, baseline, antithetic=False):
+    """
+    sim_results_dict:
+        key: parameter label
+        value: summary DataFrame containing metrics across replications
+    baseline: label of the market every other market is compared against
+    antithetic: must match the antithetic flag the runs were generated with
+
+    Every market must come from multiple_simulations(..., common_random_numbers=True) with the same n_sims and
+    antithetic setting, so replication i of every market shares its random numbers and the difference to the
+    baseline can be computed per replication; independent runs give a meaningless paired CI.
+    Returns a dict of DataFrames (one per market) with the paired CI of the difference, the CI an independent
+    comparison would give and the variance reduction achieved for each metric.
+    """
+
+    base_df = sim_results_dict[baseline]
+    for market, summary_df in sim_results_dict.items():
+        if len(summary_df) != len(base_df):
+            raise ValueError(f"{market} has {len(summary_df)} replications but {baseline} has {len(base_df)}, "
+                             f"paired differences need runs with the same n_sims")
+
+    results = {}
+
+    for market, summary_df in sim_results_dict.items():
+        if market == baseline:
+            continue
+
+        market_df = pd.DataFrame(index=summary_df.columns, columns=["ci", "independent_ci", "variance_reduction"])
+        for metric in summary_df.columns:
+            x = np.asarray(summary_df[metric], dtype=float)
+            y = np.asarray(base_df[metric], dtype=float)
+            differences = x - y
+            paired = _antithetic_pair_means(differences) if antithetic else differences
+
+            independent_variance = np.var(x, ddof=1) + np.var(y, ddof=1)  # variance of a difference without CRN
+            independent_ci = tuple(st.t.interval(0.95, 2 * len(x) - 2, loc=np.mean(differences),
+                                                 scale=np.sqrt(independent_variance / len(x))))
+
+            market_df.loc[metric] = (confidence_intervals(paired), independent_ci,
+                                     _variance_reduction(independent_variance, len(x),
+                                                         np.var(paired, ddof=1) / len(paired)))
+        results[market] = market_df
+
+    return results